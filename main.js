@@ -1,15 +1,60 @@
-import { Agent, Runner, withTrace, user, setDefaultOpenAIKey, setTracingExportApiKey } from "@openai/agents";
-import { readFileSync } from "fs";
+import { readFile } from "fs/promises";
 import { join, dirname } from "path";
 import { fileURLToPath } from "url";
-import { execSync } from "child_process";
-import OpenAI from "openai";
-import { S3Client, PutObjectCommand } from "@aws-sdk/client-s3";
-import { randomUUID } from "crypto";
+import OpenAI, { toFile } from "openai";
+import {
+  S3Client,
+  HeadObjectCommand,
+  PutObjectCommand,
+  CreateMultipartUploadCommand,
+  UploadPartCommand,
+  CompleteMultipartUploadCommand,
+  AbortMultipartUploadCommand
+} from "@aws-sdk/client-s3";
+import https from "https";
+import { PassThrough } from "stream";
+import { randomBytes, createHash } from "crypto";
 
-const myAgent = new Agent({
-  name: "My agent",
-  instructions: `Rewrite every value in the supplied funnel JSON to precisely reflect the attached brand style guide and avatar. Your task includes tone alignment, elimination of banned terms or styles, compliance with brand CTAs and reading level, while strictly preserving legal meanings and placeholders. 
+// Falls back to 8 when the env value isn't a positive integer
+const IMAGE_PROCESSING_CONCURRENCY = (() => {
+  const value = Number(process.env.IMAGE_PROCESSING_CONCURRENCY || "8");
+  return Number.isInteger(value) && value > 0 ? value : 8;
+})();
+const IMAGE_CACHE_ENABLED = process.env.IMAGE_CACHE !== "false";
+const IMAGE_BATCH_MODE = process.env.IMAGE_BATCH_MODE === "true";
+// Verbose stream dumps serialize whole event objects, so keep them opt-in
+const DEBUG = !!process.env.CC360_DEBUG;
+
+// OpenAI clients are memoized per API key and share one keep-alive agent, so
+// successive image generations reuse TLS connections to api.openai.com
+const openAIHttpAgent = new https.Agent({ keepAlive: true, maxSockets: 32, keepAliveMsecs: 30_000 });
+const openAIClients = new Map();
+
+function getOpenAIClient(apiKey) {
+  let client = openAIClients.get(apiKey);
+  if (!client) {
+    client = new OpenAI({ apiKey, httpAgent: openAIHttpAgent, maxRetries: 4, timeout: 120_000 });
+    openAIClients.set(apiKey, client);
+  }
+  return client;
+}
+
+// Every AWS client (S3 here, Secrets Manager once it is loaded) shares one keep-alive
+// agent, so TLS sessions to AWS endpoints survive across calls
+const awsHttpsAgent = new https.Agent({ keepAlive: true, maxSockets: 64 });
+
+// One S3 client per configuration, shared by every upload so sockets are reused
+// Transfer Acceleration routes uploads through the nearest edge. It must be enabled on the
+// bucket first, so it is opt-in with S3_ACCELERATE=1.
+const s3Client = new S3Client({
+  region: 'us-west-2',
+  maxAttempts: 5,
+  retryMode: 'adaptive',
+  useAccelerateEndpoint: process.env.S3_ACCELERATE === "1",
+  requestHandler: { httpsAgent: awsHttpsAgent }
+});
+
+const AGENT_INSTRUCTIONS = `Rewrite every value in the supplied funnel JSON to precisely reflect the attached brand style guide and avatar. Your task includes tone alignment, elimination of banned terms or styles, compliance with brand CTAs and reading level, while strictly preserving legal meanings and placeholders. 
 
 For all values with keys identified in \`image_url_keys\`: The images have already been processed and redesigned according to brand guidelines using OpenAI's image generation. They have been uploaded to S3 and the new URLs are provided in the PROCESSED IMAGE MAP. Simply replace the original URL values with the corresponding S3 URLs from the PROCESSED IMAGE MAP and add entries to \`asset_map\` linking the original URL to the new S3 URL.
 
@@ -100,7 +145,25 @@ Output:
 - Output must be in JSON (not Markdown), unindented, no extraneous whitespace. All arrays and strings must use valid JSON syntax.
 - Do not wrap output in code blocks.
 
-Critical reminder: You must internally reason, step by step, for every copy and image transformation using the full brand guidelines, and persist through all ambiguous cases by documenting notes/action items until all objectives are fulfilled.`,
+Critical reminder: You must internally reason, step by step, for every copy and image transformation using the full brand guidelines, and persist through all ambiguous cases by documenting notes/action items until all objectives are fulfilled.`;
+
+// Fixed guidance that used to trail every user message. Keeping it in the system prompt
+// makes the request prefix byte-identical across runs, so it is built once at import.
+const PROCESSED_IMAGES_NOTE = "IMPORTANT: The images identified in image_url_keys have already been processed and redesigned according to brand guidelines. They have been uploaded to S3 and the URLs are provided in the PROCESSED IMAGE MAP of the input. Use these S3 URLs in your output instead of the original URLs.";
+const STATIC_PREFIX = [AGENT_INSTRUCTIONS, PROCESSED_IMAGES_NOTE].join("\n\n");
+
+// The Agents SDK pulls in a large dependency graph, so it is imported on first use
+// rather than at module load; the CLI path doesn't need it until secrets resolve.
+let agentsSdkPromise = null;
+
+function loadAgentsSdk() {
+  agentsSdkPromise ??= import("@openai/agents");
+  return agentsSdkPromise;
+}
+
+const AGENT_CONFIG = {
+  name: "My agent",
+  instructions: STATIC_PREFIX,
   model: "gpt-5",
   modelSettings: {
     reasoning: {
@@ -109,13 +172,12 @@ Critical reminder: You must internally reason, step by step, for every copy and
     },
     store: true
   }
-});
+};
 
 // WorkflowInput type: { input_as_text: string }
 
 // Image processing functions
-function extractImageUrls(templateFunnelJson) {
-  const funnelData = JSON.parse(templateFunnelJson);
+function extractImageUrls(funnelData) {
   const imageUrls = [];
   
   for (const item of funnelData) {
@@ -133,16 +195,140 @@ function extractImageUrls(templateFunnelJson) {
   return imageUrls;
 }
 
-async function downloadImage(url) {
-  console.log(`   Downloading image from ${url}...`);
+const DIMENSION_SNIFF_LIMIT = 256 * 1024;
+
+// Read width/height from PNG, GIF, WebP or JPEG header bytes; null if not (yet) determinable
+function readImageDimensions(bytes) {
+  // PNG: 8-byte signature followed by the IHDR chunk
+  if (bytes.length >= 24 && bytes.readUInt32BE(0) === 0x89504e47 && bytes.toString('ascii', 12, 16) === 'IHDR') {
+    return { width: bytes.readUInt32BE(16), height: bytes.readUInt32BE(20) };
+  }
+  
+  // GIF: logical screen descriptor right after the signature
+  if (bytes.length >= 10 && bytes.toString('ascii', 0, 3) === 'GIF') {
+    return { width: bytes.readUInt16LE(6), height: bytes.readUInt16LE(8) };
+  }
+  
+  // WebP: RIFF container whose first chunk is VP8 (lossy), VP8L (lossless) or VP8X (extended)
+  if (bytes.length >= 16 && bytes.toString('ascii', 0, 4) === 'RIFF' && bytes.toString('ascii', 8, 12) === 'WEBP') {
+    switch (bytes.toString('ascii', 12, 16)) {
+      case 'VP8 ':
+        // Key frame header: 3-byte tag, start code 9d 01 2a, then 14-bit width and height
+        if (bytes.length >= 30 && bytes[23] === 0x9d && bytes[24] === 0x01 && bytes[25] === 0x2a) {
+          return { width: bytes.readUInt16LE(26) & 0x3fff, height: bytes.readUInt16LE(28) & 0x3fff };
+        }
+        break;
+      case 'VP8L':
+        // Signature byte 0x2f, then width-1 and height-1 packed as two 14-bit fields
+        if (bytes.length >= 25 && bytes[20] === 0x2f) {
+          const bits = bytes.readUInt32LE(21);
+          return { width: (bits & 0x3fff) + 1, height: ((bits >>> 14) & 0x3fff) + 1 };
+        }
+        break;
+      case 'VP8X':
+        // Canvas width-1 and height-1 as 24-bit little-endian values
+        if (bytes.length >= 30) {
+          return { width: bytes.readUIntLE(24, 3) + 1, height: bytes.readUIntLE(27, 3) + 1 };
+        }
+        break;
+    }
+    return null;
+  }
+  
+  // JPEG: walk segments up to the first start-of-frame marker
+  if (bytes.length >= 4 && bytes[0] === 0xff && bytes[1] === 0xd8) {
+    let offset = 2;
+    while (offset + 9 <= bytes.length) {
+      if (bytes[offset] !== 0xff) {
+        return null;
+      }
+      const marker = bytes[offset + 1];
+      if (marker === 0xff) {
+        offset++;
+        continue;
+      }
+      if (marker >= 0xc0 && marker <= 0xcf && marker !== 0xc4 && marker !== 0xc8 && marker !== 0xcc) {
+        return { width: bytes.readUInt16BE(offset + 7), height: bytes.readUInt16BE(offset + 5) };
+      }
+      offset += 2 + bytes.readUInt16BE(offset + 2);
+    }
+  }
+  
+  return null;
+}
+
+// Stream the original, sniffing its dimensions from the first bytes as they arrive.
+// With keepBody: false the download is cancelled as soon as the header has been read.
+async function downloadImage(url, { keepBody = true } = {}) {
+  console.log(`   ${keepBody ? 'Downloading' : 'Probing'} image from ${url}...`);
   const response = await fetch(url);
   if (!response.ok) {
     throw new Error(`Failed to download image: ${response.statusText}`);
   }
-  const arrayBuffer = await response.arrayBuffer();
-  const buffer = Buffer.from(arrayBuffer);
-  const base64 = buffer.toString('base64');
-  return { buffer, base64 };
+  
+  // The first DIMENSION_SNIFF_LIMIT bytes are copied into one header buffer as they arrive,
+  // regardless of how the response is chunked, and re-sniffed until a size is found
+  const chunks = [];
+  const header = Buffer.allocUnsafe(DIMENSION_SNIFF_LIMIT);
+  let headerLength = 0;
+  let dimensions = null;
+  for await (const chunk of response.body) {
+    if (keepBody) {
+      chunks.push(chunk);
+    }
+    if (!dimensions && headerLength < DIMENSION_SNIFF_LIMIT) {
+      headerLength += Buffer.from(chunk.buffer, chunk.byteOffset, chunk.byteLength).copy(header, headerLength);
+      dimensions = readImageDimensions(header.subarray(0, headerLength));
+    }
+    if (!keepBody && (dimensions || headerLength >= DIMENSION_SNIFF_LIMIT)) {
+      break;
+    }
+  }
+  
+  // Callers encode only what they need; base64 is left to the OpenAI request path
+  return { buffer: keepBody ? Buffer.concat(chunks) : null, dimensions };
+}
+
+// OpenAI can fetch an https original directly when it answers a HEAD without auth
+async function isPubliclyReachable(url) {
+  if (!url.startsWith('https://')) {
+    return false;
+  }
+  try {
+    const response = await fetch(url, { method: 'HEAD' });
+    return response.ok;
+  } catch {
+    return false;
+  }
+}
+
+const BRAND_LABEL = /(primary|secondary|accent|headings|body):/gi;
+const BRAND_COLOR_VALUE = /^([^(]+)\s*\(#([A-F0-9a-f]+)\)/;
+const BRAND_VISUAL_STYLE_KEYWORDS = ["Premium minimalism", "clean backgrounds", "data visualization"];
+
+// Fill the field a guide label maps to. First occurrence wins, as with the previous
+// whole-document match.
+function assignBrandField(brandInfo, label, value) {
+  switch (label) {
+    case 'primary':
+    case 'secondary':
+    case 'accent': {
+      if (brandInfo[`${label}Color`] === null) {
+        const colorMatch = BRAND_COLOR_VALUE.exec(value);
+        if (colorMatch) {
+          brandInfo[`${label}Color`] = colorMatch[1].trim();
+          brandInfo[`${label}ColorHex`] = `#${colorMatch[2].toUpperCase()}`;
+        }
+      }
+      break;
+    }
+    case 'headings':
+      brandInfo.headingFont ??= value;
+      break;
+    case 'body':
+      brandInfo.bodyFont ??= value;
+      break;
+  }
 }
 
 function extractBrandInfo(brandGuide) {
@@ -205,48 +391,43 @@ function extractBrandInfo(brandGuide) {
     return brandInfo;
   }
   
-  // Extract colors from Color Palette section
-  // Match Primary color
-  const primaryMatch = brandGuide.match(/Primary:\s*([^(]+)\s*\(#([A-F0-9a-f]+)\)/i);
-  if (primaryMatch) {
-    brandInfo.primaryColor = primaryMatch[1].trim();
-    brandInfo.primaryColorHex = `#${primaryMatch[2].toUpperCase()}`;
-  }
-  
-  // Match Secondary color
-  const secondaryMatch = brandGuide.match(/Secondary:\s*([^(]+)\s*\(#([A-F0-9a-f]+)\)/i);
-  if (secondaryMatch) {
-    brandInfo.secondaryColor = secondaryMatch[1].trim();
-    brandInfo.secondaryColorHex = `#${secondaryMatch[2].toUpperCase()}`;
-  }
-  
-  // Match Accent color
-  const accentMatch = brandGuide.match(/Accent:\s*([^(]+)\s*\(#([A-F0-9a-f]+)\)/i);
-  if (accentMatch) {
-    brandInfo.accentColor = accentMatch[1].trim();
-    brandInfo.accentColorHex = `#${accentMatch[2].toUpperCase()}`;
-  }
-  
-  // Extract typography
-  const headingMatch = brandGuide.match(/Headings:\s*([^\n]+)/i);
-  if (headingMatch) {
-    brandInfo.headingFont = headingMatch[1].trim();
-  }
-  
-  const bodyMatch = brandGuide.match(/Body:\s*([^\n]+)/i);
-  if (bodyMatch) {
-    brandInfo.bodyFont = bodyMatch[1].trim();
+  // Single pass over the guide: dispatch on each label instead of re-scanning per field.
+  // A label with nothing after it takes its value from the next non-blank line, as the
+  // previous whole-document patterns did by matching across the line break.
+  const foundKeywords = new Set();
+  let pendingLabels = [];
+  for (const line of brandGuide.split(/\r?\n/)) {
+    if (pendingLabels.length > 0 && line.trim()) {
+      for (const label of pendingLabels) {
+        assignBrandField(brandInfo, label, line.trim());
+      }
+      pendingLabels = [];
+    }
+    
+    // Every label on the line counts, and each one's value runs to the end of the line
+    for (const labelMatch of line.matchAll(BRAND_LABEL)) {
+      const label = labelMatch[1].toLowerCase();
+      const value = line.slice(labelMatch.index + labelMatch[0].length).trim();
+      if (value) {
+        assignBrandField(brandInfo, label, value);
+      } else {
+        pendingLabels.push(label);
+      }
+    }
+    
+    // Extract visual style keywords
+    for (const keyword of BRAND_VISUAL_STYLE_KEYWORDS) {
+      if (!foundKeywords.has(keyword) && line.includes(keyword)) {
+        foundKeywords.add(keyword);
+      }
+    }
   }
   
-  // Extract visual style keywords
-  if (brandGuide.includes("Premium minimalism")) {
-    brandInfo.visualStyle.push("Premium minimalism");
-  }
-  if (brandGuide.includes("clean backgrounds")) {
-    brandInfo.visualStyle.push("clean backgrounds");
-  }
-  if (brandGuide.includes("data visualization")) {
-    brandInfo.visualStyle.push("data visualization");
+  // Keep the canonical keyword order regardless of where they appear in the guide
+  for (const keyword of BRAND_VISUAL_STYLE_KEYWORDS) {
+    if (foundKeywords.has(keyword)) {
+      brandInfo.visualStyle.push(keyword);
+    }
   }
   
   return brandInfo;
@@ -280,10 +461,8 @@ function mapDimensionsToOpenAISize(width, height) {
   return "auto";
 }
 
-function getImagePrompt(imageType, elementId, transparentBg, brandGuide, elementContext) {
-  // Extract brand information from brand guide
-  const brandInfo = extractBrandInfo(brandGuide);
-  
+// Brand-derived prompt fragments never vary per image, so build them once per run
+function buildBrandPromptFragments(brandInfo) {
   // Build color guidelines
   let colorGuidelines = "";
   if (brandInfo.primaryColor && brandInfo.primaryColorHex) {
@@ -310,24 +489,102 @@ function getImagePrompt(imageType, elementId, transparentBg, brandGuide, element
   
   const baseGuidelines = `CourseCreator360 brand guidelines: ${colorGuidelines}. ${visualStyleText}.${typographyGuidelines ? ` Typography: ${typographyGuidelines}.` : ""}`;
   
+  return { colorGuidelines, typographyGuidelines, visualStyleText, baseGuidelines };
+}
+
+// Brand-dependent parts of each prompt are assembled once; the per-image closures
+// only splice in the background and context notes
+function buildPromptTemplates(brandInfo) {
+  const { typographyGuidelines, visualStyleText, baseGuidelines } = buildBrandPromptFragments(brandInfo);
+  const primary = `${brandInfo.primaryColor || "primary brand color"} (${brandInfo.primaryColorHex || "#F6C1C0"})`;
+  const secondary = `${brandInfo.secondaryColor || "secondary color"} (${brandInfo.secondaryColorHex || "#F59E0B"})`;
+  const accent = `${brandInfo.accentColor || "accent color"} (${brandInfo.accentColorHex || "#10B981"})`;
+  
+  const logoHead = `Redesign this logo to match CourseCreator360 brand. Use ${primary} wordmark.`;
+  const logoBody = ` Maintain clear space equal to the '360' height. No shadows or effects. ${visualStyleText}.`;
+  const heroHead = `Redesign this hero/CTA image with ${visualStyleText}.`;
+  const heroBody = ` Use ${primary} for primary elements, ${secondary} for accents, ${accent} for success indicators. Include clean data visualization elements if appropriate.${typographyGuidelines ? ` Typography: ${typographyGuidelines} for any text included.` : ""}`;
+  const genericHead = "Redesign this image to match CourseCreator360 brand guidelines.";
+  const tail = ` ${baseGuidelines}`;
+  
+  return {
+    logo: (backgroundNote, contextNote) => logoHead + backgroundNote + logoBody + contextNote + tail,
+    hero: (backgroundNote, contextNote) => heroHead + backgroundNote + heroBody + contextNote + tail,
+    generic: (backgroundNote, contextNote) => genericHead + backgroundNote + contextNote + tail
+  };
+}
+
+// Pick the prompt template for an element id in a single pass over the checks
+function categorizeElement(elementId) {
+  if (elementId.includes("logo")) {
+    return "logo";
+  }
+  if (elementId.includes("hero") || elementId.includes("cta_image") || elementId.includes("image_url")) {
+    return "hero";
+  }
+  return "generic";
+}
+
+function getImagePrompt(elementId, transparentBg, brandInfo, elementContext, promptTemplates = buildPromptTemplates(brandInfo)) {
   const backgroundNote = transparentBg ? " Use transparent background." : " Use white/opaque background.";
   
   // Include element context if available
-  let contextNote = "";
-  if (elementContext && elementContext.alt_text) {
-    contextNote = ` The image should depict: ${elementContext.alt_text}.`;
-  }
+  const contextNote = elementContext && elementContext.alt_text ? ` The image should depict: ${elementContext.alt_text}.` : "";
   
-  if (elementId.includes("logo")) {
-    return `Redesign this logo to match CourseCreator360 brand. Use ${brandInfo.primaryColor || "primary brand color"} (${brandInfo.primaryColorHex || "#F6C1C0"}) wordmark.${backgroundNote} Maintain clear space equal to the '360' height. No shadows or effects. ${visualStyleText}.${contextNote} ${baseGuidelines}`;
-  } else if (elementId.includes("hero") || elementId.includes("cta_image") || elementId.includes("image_url")) {
-    return `Redesign this hero/CTA image with ${visualStyleText}.${backgroundNote} Use ${brandInfo.primaryColor || "primary brand color"} (${brandInfo.primaryColorHex || "#F6C1C0"}) for primary elements, ${brandInfo.secondaryColor || "secondary color"} (${brandInfo.secondaryColorHex || "#F59E0B"}) for accents, ${brandInfo.accentColor || "accent color"} (${brandInfo.accentColorHex || "#10B981"}) for success indicators. Include clean data visualization elements if appropriate.${typographyGuidelines ? ` Typography: ${typographyGuidelines} for any text included.` : ""}${contextNote} ${baseGuidelines}`;
-  } else {
-    return `Redesign this image to match CourseCreator360 brand guidelines.${backgroundNote}${contextNote} ${baseGuidelines}`;
+  return promptTemplates[categorizeElement(elementId)](backgroundNote, contextNote);
+}
+
+// Responses API body shared by the streaming path and the Batch API path
+function buildImageGenerationRequest(imageUrl, prompt, size, transparentBg, { partialImages = 3 } = {}) {
+  const imageTool = {
+    type: "image_generation",
+    model: "gpt-image-1",
+    size: size,
+    quality: transparentBg ? "medium" : "auto", // Use medium quality for transparency (works best per docs)
+    output_format: "png",
+    background: transparentBg ? "transparent" : "opaque",
+    moderation: "auto"
+  };
+  // Partial images are only emitted when streaming
+  if (partialImages) {
+    imageTool.partial_images = partialImages;
   }
+  
+  return {
+    model: "gpt-5",
+    input: [
+      {
+        role: "user",
+        content: [
+          {
+            type: "input_image",
+            image_url: imageUrl
+          },
+          {
+            type: "input_text",
+            text: prompt
+          }
+        ]
+      }
+    ],
+    text: {
+      format: {
+        type: "text"
+      },
+      verbosity: "medium"
+    },
+    reasoning: {
+      effort: "medium",
+      summary: "auto"
+    },
+    tools: [imageTool],
+    store: true
+  };
 }
 
-async function generateImageWithOpenAI(originalImageBase64, imageType, elementId, apiKey, transparentBg, brandGuide, elementContext, width, height) {
+// When `output` is given, the decoded image is written to it and the stream is ended,
+// so a pending S3 upload can consume it without another buffer hand-off.
+async function generateImageWithOpenAI(originalImageBase64, elementId, apiKey, transparentBg, brandInfo, elementContext, width, height, promptTemplates, output = null, originalImageUrl = null) {
   console.log(`   Generating image with OpenAI for ${elementId}...`);
   if (transparentBg) {
     console.log(`   Using transparent background`);
@@ -337,8 +594,8 @@ async function generateImageWithOpenAI(originalImageBase64, imageType, elementId
   const size = mapDimensionsToOpenAISize(width, height);
   console.log(`   Dimensions: ${width}x${height} → OpenAI size: ${size}`);
   
-  const client = new OpenAI({ apiKey });
-  const prompt = getImagePrompt(imageType, elementId, transparentBg, brandGuide, elementContext);
+  const client = getOpenAIClient(apiKey);
+  const prompt = getImagePrompt(elementId, transparentBg, brandInfo, elementContext, promptTemplates);
   
   // Log the complete prompt
   console.log("\n" + "=".repeat(80));
@@ -347,126 +604,79 @@ async function generateImageWithOpenAI(originalImageBase64, imageType, elementId
   console.log(prompt);
   console.log("=".repeat(80) + "\n");
   
+  // The client's own retries (maxRetries) cover failures until the response stream opens;
+  // errors after that are tagged so the caller can decide whether to start over
+  let streamOpened = false;
   try {
     // Use streaming to see reasoning and get partial images
     const stream = await client.responses.create({
-      model: "gpt-5",
-      input: [
-      {
-        role: "user",
-        content: [
-            {
-              type: "input_image",
-              image_url: `data:image/png;base64,${originalImageBase64}`
-            },
-          {
-            type: "input_text",
-              text: prompt
-            }
-          ]
-        }
-      ],
-      text: {
-        format: {
-          type: "text"
-        },
-        verbosity: "medium"
-      },
-      reasoning: {
-        effort: "medium",
-        summary: "auto"
-      },
-      tools: [
-        {
-          type: "image_generation",
-          model: "gpt-image-1",
-          size: size,
-          quality: transparentBg ? "medium" : "auto", // Use medium quality for transparency (works best per docs)
-          output_format: "png",
-          background: transparentBg ? "transparent" : "opaque",
-          moderation: "auto",
-          partial_images: 3
-        }
-      ],
-      store: true,
+      ...buildImageGenerationRequest(originalImageBase64 ? `data:image/png;base64,${originalImageBase64}` : originalImageUrl, prompt, size, transparentBg),
       stream: true
     });
+    streamOpened = true;
     
     let finalImageBuffer = null;
-    
     let storedResponseId = null;
-    const chunks = [];
     
-    // Process stream events
+    // Process stream events; each chunk is dispatched once on its part/item type
     for await (const chunk of stream) {
-      chunks.push(chunk);
-      
-      // Save response ID if provided
-      if (chunk.response && chunk.response.id) {
+      // Save response ID the first time it is provided
+      if (!storedResponseId && chunk.response?.id) {
         storedResponseId = chunk.response.id;
       }
       
-      // Check for item chunks with part data
-      if (chunk.part) {
-        // Check if part is tool_use for image_generation
-        if (chunk.part.type === 'tool_use') {
-          if (chunk.part.name === 'image_generation' || chunk.part.name === 'image') {
-            console.log(`\n   🔧 Found tool_use part: ${JSON.stringify(chunk.part, null, 2).substring(0, 400)}`);
-            // The output might come in a later chunk or need to be fetched
-          }
-        }
-        
-        // Check if part is image
-        if (chunk.part.type === 'image' || chunk.part.type === 'image_url') {
-          console.log(`\n   🖼️  Found image part: ${JSON.stringify(chunk.part, null, 2).substring(0, 200)}`);
-          const imageBuffer = await extractImageFromOutput(chunk.part.image_url || chunk.part.url || chunk.part);
-          if (imageBuffer) {
-            finalImageBuffer = imageBuffer;
-            process.stdout.write(`\n   ✓ Image generated`);
-            break;
-          }
+      // Fast path: gpt-image-1 inside Responses delivers base64 in image_generation_call.result
+      if (chunk.item?.type === 'image_generation_call' && chunk.item.result) {
+        finalImageBuffer = decodeImageGenerationResult(chunk.item.result);
+        if (finalImageBuffer) {
+          process.stdout.write(`\n   ✓ Image generated from stream`);
+          break;
         }
       }
       
-      // Check for item chunks
-      if (chunk.item) {
-        // Check for image_generation_call in item
-        if (chunk.item.type === 'image_generation_call') {
-          if (chunk.item.result) {
-            try {
-              const imageBuffer = Buffer.from(chunk.item.result, 'base64');
-              if (imageBuffer.length > 0) {
-                finalImageBuffer = imageBuffer;
-                process.stdout.write(`\n   ✓ Image generated from stream`);
-                break;
-              }
-            } catch (e) {
-              // Continue checking other fields
+      let imageBuffer = null;
+      let source = null;
+      
+      // Legacy shapes (tool_use output, image parts) go through the generic extractor
+      if (chunk.part) {
+        switch (chunk.part.type) {
+          case 'tool_use':
+            // The output might come in a later chunk or need to be fetched
+            if (DEBUG && (chunk.part.name === 'image_generation' || chunk.part.name === 'image')) {
+              console.log(`\n   🔧 Found tool_use part: ${JSON.stringify(chunk.part, null, 2).substring(0, 400)}`);
             }
-          }
+            break;
+          case 'image':
+          case 'image_url':
+            if (DEBUG) {
+              console.log(`\n   🖼️  Found image part: ${JSON.stringify(chunk.part, null, 2).substring(0, 200)}`);
+            }
+            imageBuffer = await extractImageFromOutput(chunk.part.image_url || chunk.part.url || chunk.part);
+            source = "";
+            break;
+          case 'image_generation_call':
+            imageBuffer = decodeImageGenerationResult(chunk.part.result);
+            source = " from part";
+            break;
         }
-        
+      } else if (chunk.item) {
         if (chunk.item.type === 'tool_use' && (chunk.item.name === 'image_generation' || chunk.item.name === 'image')) {
-          console.log(`\n   🔧 Found tool_use item: ${JSON.stringify(chunk.item, null, 2).substring(0, 400)}`);
-          // Check for output in item
+          if (DEBUG) {
+            console.log(`\n   🔧 Found tool_use item: ${JSON.stringify(chunk.item, null, 2).substring(0, 400)}`);
+          }
           if (chunk.item.output) {
-            const imageBuffer = await extractImageFromOutput(chunk.item.output);
-            if (imageBuffer) {
-              finalImageBuffer = imageBuffer;
-              process.stdout.write(`\n   ✓ Image generated`);
-              break;
-            }
+            imageBuffer = await extractImageFromOutput(chunk.item.output);
+            source = "";
           }
         }
         
         // Check item content for images
-        if (chunk.item.content) {
+        if (!imageBuffer?.length && chunk.item.content) {
           for (const contentItem of chunk.item.content) {
             if (contentItem.type === 'image' || contentItem.type === 'image_url') {
-              const imageBuffer = await extractImageFromOutput(contentItem.image_url || contentItem.url);
-              if (imageBuffer) {
-                finalImageBuffer = imageBuffer;
-                process.stdout.write(`\n   ✓ Image generated`);
+              imageBuffer = await extractImageFromOutput(contentItem.image_url || contentItem.url);
+              source = "";
+              if (imageBuffer?.length) {
                 break;
               }
             }
@@ -474,22 +684,10 @@ async function generateImageWithOpenAI(originalImageBase64, imageType, elementId
         }
       }
       
-      // Check part for image_generation_call
-      if (chunk.part) {
-        if (chunk.part.type === 'image_generation_call') {
-          if (chunk.part.result) {
-            try {
-              const imageBuffer = Buffer.from(chunk.part.result, 'base64');
-              if (imageBuffer.length > 0) {
-                finalImageBuffer = imageBuffer;
-                process.stdout.write(`\n   ✓ Image generated from part`);
-                break;
-              }
-            } catch (e) {
-              // Continue checking
-            }
-          }
-        }
+      if (imageBuffer?.length) {
+        finalImageBuffer = imageBuffer;
+        process.stdout.write(`\n   ✓ Image generated${source}`);
+        break;
       }
       
       // Log reasoning delta if available
@@ -510,18 +708,11 @@ async function generateImageWithOpenAI(originalImageBase64, imageType, elementId
             // Check for image_generation_call with result
             if (outputItem.type === 'image_generation_call') {
               console.log(`\n   🖼️  Found image_generation_call, status: ${outputItem.status}`);
-              if (outputItem.result) {
-                // result is base64 encoded image data
-                try {
-                  const imageBuffer = Buffer.from(outputItem.result, 'base64');
-                  if (imageBuffer.length > 0) {
-                    finalImageBuffer = imageBuffer;
-                    process.stdout.write(`\n   ✓ Image found in image_generation_call result`);
-                    break;
-                  }
-                } catch (e) {
-                  console.log(`\n   ⚠️  Failed to decode result: ${e.message}`);
-                }
+              const imageBuffer = decodeImageGenerationResult(outputItem.result);
+              if (imageBuffer) {
+                finalImageBuffer = imageBuffer;
+                process.stdout.write(`\n   ✓ Image found in image_generation_call result`);
+                break;
               }
             }
             
@@ -560,13 +751,30 @@ async function generateImageWithOpenAI(originalImageBase64, imageType, elementId
       throw new Error("No image found in OpenAI stream response");
     }
     
+    if (output) {
+      output.end(finalImageBuffer);
+    }
+    
     return finalImageBuffer;
   } catch (error) {
     console.error(`\n   Error generating image: ${error.message}`);
+    if (streamOpened && error instanceof Error) {
+      error.streamOpened = true;
+    }
     throw error;
   }
 }
 
+// image_generation_call.result is always a bare base64 PNG; null when empty
+function decodeImageGenerationResult(result) {
+  if (!result) {
+    return null;
+  }
+  const imageBuffer = Buffer.from(result, 'base64');
+  return imageBuffer.length > 0 ? imageBuffer : null;
+}
+
+// Generic decoder for legacy output shapes (data URL, http URL, bare base64, wrapped objects)
 async function extractImageFromOutput(output) {
   // Handle different output formats
   if (typeof output === 'string') {
@@ -621,41 +829,480 @@ async function extractImageFromOutput(output) {
   return null;
 }
 
-function generateS3Key(originalUrl) {
-  const today = new Date();
-  const dateStr = today.toISOString().split('T')[0].replace(/-/g, '');
-  const uuid = randomUUID().split('-')[0];
-  const extension = originalUrl.split('.').pop().split('?')[0] || 'png';
-  return `${dateStr}-${uuid}.${extension}`;
+// YYYYMMDD prefix for generated keys; computed once per run
+function currentDateStamp() {
+  return new Date().toISOString().slice(0, 10).replace(/-/g, '');
+}
+
+function generateS3Key(originalUrl, dateStr = currentDateStamp()) {
+  const id = randomBytes(4).toString('hex');
+  const extension = /\.([a-z0-9]+)(?:\?|$)/i.exec(originalUrl)?.[1] ?? 'png';
+  return `${dateStr}-${id}.${extension}`;
+}
+
+// Deterministic S3 key for a generated image: a hash of the generation request itself, so
+// the source URL, final prompt, size and models all count and any change to them (or to
+// the prompt templates) yields a new key rather than a stale immutable object
+function generateCacheKey(sourceUrl, prompt, size, transparentBg) {
+  const request = buildImageGenerationRequest(sourceUrl, prompt, size, transparentBg, { partialImages: 0 });
+  const hash = createHash('sha256')
+    .update(JSON.stringify(request))
+    .digest('hex')
+    .slice(0, 16);
+  return `generated/${hash}.png`;
 }
 
-async function uploadToS3(buffer, key, contentType = 'image/png') {
+// Return the public URL of a previously generated image, or null on a cache miss
+async function findCachedImage(key) {
+  try {
+    await s3Client.send(new HeadObjectCommand({ Bucket: 'cc360-pages', Key: key }));
+    return `https://cc360-pages.s3.us-west-2.amazonaws.com/${key}`;
+  } catch (error) {
+    if (error.name !== 'NotFound' && error.$metadata?.httpStatusCode !== 404) {
+      console.log(`   ⚠️  Cache lookup failed for ${key}: ${error.message}`);
+    }
+    return null;
+  }
+}
+
+// Generated images are made public with an object ACL, as the bucket accepts ACLs.
+// S3_PUBLIC_ACL=0 omits it for buckets with ACLs disabled that grant access by policy.
+const S3_PUBLIC_ACL = process.env.S3_PUBLIC_ACL !== "0";
+
+// Bodies above one part are sent as a multipart upload with parts in parallel
+const UPLOAD_PART_SIZE = 5 * 1024 * 1024;
+const UPLOAD_QUEUE_SIZE = 4;
+
+// `body` is a Buffer or a stream that is ended with the whole image (see generateImageWithOpenAI)
+async function uploadToS3(body, key, contentType = 'image/png') {
   console.log(`   Uploading to S3: ${key}...`);
   
-  const s3Client = new S3Client({ region: 'us-west-2' });
-  
-  const command = new PutObjectCommand({
+  const buffer = Buffer.isBuffer(body) ? body : Buffer.concat(await body.toArray());
+  const params = {
     Bucket: 'cc360-pages',
     Key: key,
-    Body: buffer,
     ContentType: contentType,
-    ACL: 'public-read',
+    ...(S3_PUBLIC_ACL ? { ACL: 'public-read' } : {}),
     CacheControl: 'max-age=31536000, public, immutable', // Cache permanently (no expiration)
+    ChecksumAlgorithm: 'CRC32',
     Metadata: {
       'permanent': 'true' // Mark as permanent asset
     }
-  });
+  };
   
-  await s3Client.send(command);
+  if (buffer.length <= UPLOAD_PART_SIZE) {
+    await s3Client.send(new PutObjectCommand({ ...params, Body: buffer }));
+  } else {
+    await uploadMultipart(params, buffer);
+  }
   
   const url = `https://cc360-pages.s3.us-west-2.amazonaws.com/${key}`;
   console.log(`   ✓ Uploaded to ${url}`);
   return url;
 }
 
-async function processImages(templateFunnelJson, brandGuide, apiKey) {
+async function uploadMultipart(params, buffer) {
+  const { Bucket, Key, ChecksumAlgorithm } = params;
+  const { UploadId } = await s3Client.send(new CreateMultipartUploadCommand(params));
+  
+  try {
+    const partNumbers = Array.from({ length: Math.ceil(buffer.length / UPLOAD_PART_SIZE) }, (_, i) => i + 1);
+    const parts = await mapPool(partNumbers, UPLOAD_QUEUE_SIZE, async (PartNumber) => {
+      const { ETag, ChecksumCRC32 } = await s3Client.send(new UploadPartCommand({
+        Bucket,
+        Key,
+        UploadId,
+        PartNumber,
+        ChecksumAlgorithm,
+        Body: buffer.subarray((PartNumber - 1) * UPLOAD_PART_SIZE, PartNumber * UPLOAD_PART_SIZE)
+      }));
+      return { PartNumber, ETag, ChecksumCRC32 };
+    });
+    
+    const failed = parts.find(part => part.status === 'rejected');
+    if (failed) {
+      throw failed.reason;
+    }
+    await s3Client.send(new CompleteMultipartUploadCommand({
+      Bucket,
+      Key,
+      UploadId,
+      MultipartUpload: { Parts: parts.map(part => part.value) }
+    }));
+  } catch (error) {
+    // Don't leave orphaned parts behind
+    await s3Client.send(new AbortMultipartUploadCommand({ Bucket, Key, UploadId })).catch(() => {});
+    throw error;
+  }
+}
+
+const sleep = (ms) => new Promise(resolve => setTimeout(resolve, ms));
+
+// Retry fn with capped exponential backoff plus jitter for as long as shouldRetry(error) holds
+async function withRetries(fn, { retries = 4, baseMs = 500, maxMs = 30_000, jitterMs = 250, shouldRetry = () => true, onRetry = null } = {}) {
+  for (let attempt = 0; ; attempt++) {
+    try {
+      return await fn(attempt);
+    } catch (error) {
+      if (attempt >= retries || !shouldRetry(error)) {
+        throw error;
+      }
+      const delay = Math.min(maxMs, baseMs * 2 ** attempt) + Math.random() * jitterMs;
+      if (onRetry) {
+        onRetry(error, attempt + 1, delay);
+      }
+      await sleep(delay);
+    }
+  }
+}
+
+// The OpenAI client already retries rate limits and server errors up to the point the
+// response stream opens, so only a transient failure mid-stream warrants a fresh request
+function isRetryableImageStreamError(error) {
+  return error.streamOpened === true && isRetryableOpenAIError(error);
+}
+
+// Rate limits, server errors and dropped connections are worth another attempt
+function isRetryableOpenAIError(error) {
+  if (error instanceof OpenAI.APIConnectionError) {
+    return true;
+  }
+  if (typeof error.status === 'number') {
+    return error.status === 429 || error.status >= 500;
+  }
+  return ['ECONNRESET', 'ETIMEDOUT', 'EPIPE', 'UND_ERR_SOCKET'].includes(error.code);
+}
+
+// Run fn over items with at most `limit` calls in flight. Results are returned
+// in input order with Promise.allSettled semantics so one failure doesn't abort the rest.
+async function mapPool(items, limit, fn) {
+  const results = new Array(items.length);
+  let cursor = 0;
+  
+  const worker = async () => {
+    while (cursor < items.length) {
+      const index = cursor++;
+      try {
+        results[index] = { status: 'fulfilled', value: await fn(items[index], index) };
+      } catch (reason) {
+        results[index] = { status: 'rejected', reason };
+      }
+    }
+  };
+  
+  // A non-numeric limit would otherwise start no workers and leave every result empty
+  const workerCount = Math.max(1, Math.min(Number.isInteger(limit) && limit > 0 ? limit : 1, items.length));
+  await Promise.all(Array.from({ length: workerCount }, worker));
+  return results;
+}
+
+// Terminal states reported by the Batch API
+const BATCH_TERMINAL_STATUSES = new Set(["completed", "failed", "expired", "cancelled"]);
+
+async function waitForBatch(client, batchId) {
+  let delay = 5000;
+  for (;;) {
+    const batch = await client.batches.retrieve(batchId);
+    if (BATCH_TERMINAL_STATUSES.has(batch.status)) {
+      return batch;
+    }
+    console.log(`   ⏳ Batch ${batchId} is ${batch.status} (${batch.request_counts?.completed ?? 0}/${batch.request_counts?.total ?? "?"} done)`);
+    await sleep(delay);
+    delay = Math.min(delay * 2, 60000);
+  }
+}
+
+// Add the records of a batch result file to `records`, keyed by custom_id. Requests that
+// failed carry the API error in the response body; it is surfaced as `record.error` so
+// callers read one field whichever way the request failed.
+async function readBatchFile(client, fileId, records) {
+  const text = await (await client.files.content(fileId)).text();
+  for (const line of text.split("\n")) {
+    if (line.trim()) {
+      const record = JSON.parse(line);
+      if (record.response?.status_code >= 400) {
+        record.error ??= record.response.body?.error ?? null;
+      }
+      records.set(record.custom_id, record);
+    }
+  }
+}
+
+// Submit JSONL request lines as one /v1/responses batch, wait for it to finish and
+// return the records of both the output and error files keyed by custom_id (output
+// order is not guaranteed). Failed requests keep their API error in `record.error`.
+async function runBatch(client, lines, filename) {
+  const inputFile = await client.files.create({
+    file: await toFile(Buffer.from(lines.join("\n")), filename),
+    purpose: "batch"
+  });
+  const created = await client.batches.create({
+    input_file_id: inputFile.id,
+    endpoint: "/v1/responses",
+    completion_window: "24h"
+  });
+  
+  const batch = await waitForBatch(client, created.id);
+  if (batch.status !== "completed") {
+    const reason = batch.errors?.data?.[0]?.message;
+    throw new Error(`Batch ${batch.id} ended with status ${batch.status}${reason ? `: ${reason}` : ""}`);
+  }
+  
+  // A batch whose requests all failed still completes, with only an error file
+  const records = new Map();
+  await Promise.all(
+    [batch.output_file_id, batch.error_file_id]
+      .filter(Boolean)
+      .map(fileId => readBatchFile(client, fileId, records))
+  );
+  return records;
+}
+
+async function downloadImageBase64(url) {
+  const { buffer } = await downloadImage(url);
+  return buffer.toString('base64');
+}
+
+// OpenAI rejects an image URL with a 400 when it can't download it (hotlink protection,
+// blocked user agents, ...); the same bytes usually go through when inlined instead
+function isImageUrlRejection(error) {
+  return error?.code === 'invalid_image_url' || (error?.status === 400 && /error while downloading/i.test(error.message ?? ''));
+}
+
+// Everything an image needs before generation, shared by the streaming and batch paths.
+// Returns { cachedUrl } when an earlier generation of the same request can be reused.
+// Otherwise returns the S3 key to write to, the original as either a public URL OpenAI
+// can fetch itself or inline base64, the output dimensions, and the prompt and size.
+async function prepareImageInput(imageInfo, brandInfo, elementContext, promptTemplates, dateStr) {
+  // The output size comes from the source when the template doesn't give it, and the size
+  // is part of the cache key. That download is then inlined into the request as well, so
+  // the original is fetched once: no HEAD, and OpenAI doesn't fetch it again.
+  let base64 = null;
+  let dimensions = null;
+  if (!imageInfo.width || !imageInfo.height) {
+    const original = await downloadImage(imageInfo.url);
+    base64 = original.buffer.toString('base64');
+    dimensions = original.dimensions;
+  }
+  const width = imageInfo.width || dimensions?.width;
+  const height = imageInfo.height || dimensions?.height;
+  const prompt = getImagePrompt(imageInfo.elementId, imageInfo.transparentBg, brandInfo, elementContext, promptTemplates);
+  const size = mapDimensionsToOpenAISize(width, height);
+  
+  const cacheKey = IMAGE_CACHE_ENABLED ? generateCacheKey(imageInfo.url, prompt, size, imageInfo.transparentBg) : null;
+  const cachedUrl = cacheKey ? await findCachedImage(cacheKey) : null;
+  if (cachedUrl) {
+    return { cachedUrl };
+  }
+  
+  // Otherwise let OpenAI fetch public originals itself; only inline the bytes when it can't
+  let originalImageUrl = null;
+  if (!base64) {
+    if (await isPubliclyReachable(imageInfo.url)) {
+      originalImageUrl = imageInfo.url;
+    } else {
+      base64 = await downloadImageBase64(imageInfo.url);
+    }
+  }
+  
+  return {
+    s3Key: cacheKey || generateS3Key(imageInfo.url, dateStr),
+    base64,
+    originalImageUrl,
+    width,
+    height,
+    prompt,
+    size
+  };
+}
+
+function buildImageBatchLine(index, imageInfo, input) {
+  const inputImageUrl = input.originalImageUrl ?? `data:image/png;base64,${input.base64}`;
+  return JSON.stringify({
+    custom_id: `image-${index}`,
+    method: "POST",
+    url: "/v1/responses",
+    body: buildImageGenerationRequest(inputImageUrl, input.prompt, input.size, imageInfo.transparentBg, { partialImages: 0 })
+  });
+}
+
+// Generate images through the OpenAI Batch API (one JSONL request per image), then
+// upload the results to S3. Returns results in input order, settled per image.
+async function processImagesWithBatchAPI(imageUrls, getElementContext, brandInfo, promptTemplates, apiKey, dateStr) {
+  const client = getOpenAIClient(apiKey);
+  const results = new Array(imageUrls.length);
+  const pending = [];
+  
+  // Resolve cache hits and build a request line for every remaining image
+  const prepared = await mapPool(imageUrls, IMAGE_PROCESSING_CONCURRENCY, async (imageInfo, index) => {
+    const elementContext = getElementContext(imageInfo);
+    const input = await prepareImageInput(imageInfo, brandInfo, elementContext, promptTemplates, dateStr);
+    if (input.cachedUrl) {
+      console.log(`   ✓ Reusing cached image for ${imageInfo.elementId}: ${input.cachedUrl}`);
+      return { s3Url: input.cachedUrl };
+    }
+    
+    return { s3Key: input.s3Key, input, line: buildImageBatchLine(index, imageInfo, input) };
+  });
+  
+  // Elements whose requests are identical (same cache key) share one batch line
+  const pendingByKey = new Map();
+  const duplicates = [];
+  prepared.forEach((entry, index) => {
+    const imageInfo = imageUrls[index];
+    if (entry.status === 'rejected') {
+      results[index] = entry;
+    } else if (entry.value.s3Url) {
+      results[index] = { status: 'fulfilled', value: { originalUrl: imageInfo.url, s3Url: entry.value.s3Url, width: imageInfo.width, height: imageInfo.height } };
+    } else if (pendingByKey.has(entry.value.s3Key)) {
+      duplicates.push({ index, of: pendingByKey.get(entry.value.s3Key) });
+    } else {
+      pendingByKey.set(entry.value.s3Key, index);
+      pending.push({ index, ...entry.value });
+    }
+  });
+  
+  if (pending.length === 0) {
+    return results;
+  }
+  
+  const copyToDuplicates = () => {
+    for (const { index, of } of duplicates) {
+      const imageInfo = imageUrls[index];
+      const source = results[of];
+      results[index] = source.status === 'fulfilled'
+        ? { status: 'fulfilled', value: { ...source.value, originalUrl: imageInfo.url, width: imageInfo.width, height: imageInfo.height } }
+        : source;
+    }
+    return results;
+  };
+  
+  const failPending = (reason) => {
+    for (const { index } of pending) {
+      results[index] = { status: 'rejected', reason };
+    }
+    return copyToDuplicates();
+  };
+  
+  try {
+    console.log(`   Submitting ${pending.length} image request(s) to the Batch API...`);
+    const outputs = await runBatch(client, pending.map(p => p.line), "image-requests.jsonl");
+    
+    // Originals OpenAI couldn't fetch by URL go through a second batch with the bytes inlined
+    const rejected = pending.filter(({ index, input }) =>
+      input.originalImageUrl && isImageUrlRejection(outputs.get(`image-${index}`)?.error));
+    if (rejected.length > 0) {
+      console.log(`   ↻ OpenAI could not fetch ${rejected.length} original(s); resubmitting with the images inlined...`);
+      const retried = await mapPool(rejected, IMAGE_PROCESSING_CONCURRENCY, async ({ index, input }) => {
+        const imageInfo = imageUrls[index];
+        const inlined = { ...input, originalImageUrl: null, base64: await downloadImageBase64(imageInfo.url) };
+        return buildImageBatchLine(index, imageInfo, inlined);
+      });
+      const lines = retried.filter(entry => entry.status === 'fulfilled').map(entry => entry.value);
+      if (lines.length > 0) {
+        for (const [customId, record] of await runBatch(client, lines, "image-requests-inline.jsonl")) {
+          outputs.set(customId, record);
+        }
+      }
+    }
+    
+    // Upload the decoded images in parallel
+    const uploads = await mapPool(pending, IMAGE_PROCESSING_CONCURRENCY, async ({ index, s3Key }) => {
+      const imageInfo = imageUrls[index];
+      const record = outputs.get(`image-${index}`);
+      const imageCall = record?.response?.body?.output?.find(item => item.type === 'image_generation_call' && item.result);
+      if (!imageCall) {
+        throw new Error(record?.error?.message || `No image returned for ${imageInfo.elementId}`);
+      }
+      
+      const s3Url = await uploadToS3(decodeImageGenerationResult(imageCall.result), s3Key, 'image/png');
+      console.log(`   ✓ Completed ${imageInfo.elementId}`);
+      return { originalUrl: imageInfo.url, s3Url, width: imageInfo.width, height: imageInfo.height };
+    });
+    
+    uploads.forEach((upload, i) => {
+      results[pending[i].index] = upload;
+    });
+    return copyToDuplicates();
+  } catch (error) {
+    return failPending(error);
+  }
+}
+
+// The guide's decorative rule lines, trailing whitespace and blank-line runs are pure
+// formatting; strip them before the guide goes into the system prompt. Section headings,
+// list indentation and all prose are kept verbatim.
+const BRAND_GUIDE_RULE_LINE = /^\s*[=\-]{3,}\s*$/;
+
+function compactBrandGuide(brandGuide) {
+  return brandGuide
+    .split('\n')
+    .filter(line => !BRAND_GUIDE_RULE_LINE.test(line))
+    .map(line => line.trimEnd())
+    .join('\n')
+    .replace(/\n{3,}/g, '\n\n')
+    .trim();
+}
+
+// Agent whose instructions are the static prefix followed by the brand guide. The guide is
+// stable across runs, so the whole system prompt is a cacheable prefix; the agent is reused
+// for as long as the guide text is unchanged.
+let brandAgent = null;
+let brandAgentGuide = null;
+
+async function getBrandAgent(brandGuide) {
+  if (brandAgent === null || brandAgentGuide !== brandGuide) {
+    const { Agent } = await loadAgentsSdk();
+    brandAgent = new Agent({
+      ...AGENT_CONFIG,
+      instructions: [STATIC_PREFIX, "=== BRAND STYLE GUIDE & AVATAR ===", compactBrandGuide(brandGuide)].join("\n\n")
+    });
+    brandAgentGuide = brandGuide;
+  }
+  return brandAgent;
+}
+
+// One-line debug summary of a run item: its type and a truncated text preview.
+// Non-text payloads are described rather than serialized.
+function summarizeRunItem(item, maxChars = 200) {
+  if (typeof item === 'string') {
+    return item.length > maxChars ? `${item.slice(0, maxChars)}…` : item;
+  }
+  const text = item.reasoning ?? item.content ?? item.text;
+  const preview = typeof text === 'string'
+    ? (text.length > maxChars ? `${text.slice(0, maxChars)}…` : text)
+    : `<${Array.isArray(text) ? `${text.length} part(s)` : typeof text}>`;
+  return `${item.type ?? 'item'}: ${preview}`;
+}
+
+// One Runner serves every run. Its trace metadata is the same for all workflows, so
+// nothing per-run needs to be baked into (or overridden on) the shared instance.
+let sharedRunner = null;
+
+function getRunner(Runner) {
+  sharedRunner ??= new Runner({
+    traceMetadata: {
+      __trace_source__: "agent-builder",
+      workflow_id: "wf_69043945c8e48190bbe9d846914c78a80d481960236c2925"
+    }
+  });
+  return sharedRunner;
+}
+
+// Takes the parsed brandInfo rather than the guide text so per-image work never retains the full guide
+async function processImages(templateFunnelJson, brandInfo, apiKey) {
   console.log("\n🖼️  Processing images...");
-  const imageUrls = extractImageUrls(templateFunnelJson);
+  // Parse the template once; the same array serves image discovery and element context
+  const funnelData = JSON.parse(templateFunnelJson);
+  const imageUrls = extractImageUrls(funnelData);
+  
+  // Index elements by id so per-image context lookup is O(1); first occurrence wins like find()
+  const elementById = new Map();
+  for (const item of funnelData) {
+    if (!elementById.has(item.element_id)) {
+      elementById.set(item.element_id, item);
+    }
+  }
   
   if (imageUrls.length === 0) {
     console.log("   No images found to process.");
@@ -664,59 +1311,150 @@ async function processImages(templateFunnelJson, brandGuide, apiKey) {
   
   console.log(`   Found ${imageUrls.length} image(s) to process.\n`);
   
-  // Parse template funnel to extract element context
-  const funnelData = JSON.parse(templateFunnelJson);
+  const promptTemplates = buildPromptTemplates(brandInfo);
+  const dateStr = currentDateStamp();
   
-  const imageMap = {};
-  const imageUrlKeys = [];
+  // Find matching element in template funnel to get context
+  const getElementContext = (imageInfo) => {
+    const element = elementById.get(imageInfo.elementId);
+    return element ? {
+      alt_text: element.alt_text || null,
+      element_id: element.element_id,
+      type: element.type
+    } : null;
+  };
   
-  for (const imageInfo of imageUrls) {
-    try {
-      console.log(`📸 Processing ${imageInfo.elementId}...`);
-      
-      // Find matching element in template funnel to get context
-      const element = funnelData.find(item => item.element_id === imageInfo.elementId);
-      const elementContext = element ? {
-        alt_text: element.alt_text || null,
-        element_id: element.element_id,
-        type: element.type
-      } : null;
-      
-      // Download original image
-      const { buffer, base64 } = await downloadImage(imageInfo.url);
-      
-      // Determine image type
-      const imageType = imageInfo.elementId.includes("logo") ? "logo" : "hero";
-      
-      // Generate new image with OpenAI
-      const generatedBuffer = await generateImageWithOpenAI(base64, imageType, imageInfo.elementId, apiKey, imageInfo.transparentBg, brandGuide, elementContext, imageInfo.width, imageInfo.height);
-      
-      // Upload to S3
-      const s3Key = generateS3Key(imageInfo.url);
-      const s3Url = await uploadToS3(generatedBuffer, s3Key, 'image/png');
-      
-      imageMap[imageInfo.elementId] = {
+  // Generate the image and stream it into S3; resolves to the uploaded URL
+  const generateAndUpload = async (imageInfo, elementContext, { s3Key, base64, originalImageUrl, width, height }) => {
+    // Start the S3 upload first and let generation feed it through a stream
+    const imageStream = new PassThrough();
+    const generate = (imageBase64, imageUrl) => withRetries(
+      () => generateImageWithOpenAI(imageBase64, imageInfo.elementId, apiKey, imageInfo.transparentBg, brandInfo, elementContext, width, height, promptTemplates, imageStream, imageUrl),
+      {
+        retries: 2,
+        shouldRetry: isRetryableImageStreamError,
+        onRetry: (error, attempt, delay) => console.log(`   ↻ Retrying ${imageInfo.elementId} (attempt ${attempt}) in ${Math.round(delay)}ms: ${error.message}`)
+      }
+    );
+    
+    const [s3Url] = await Promise.all([
+      uploadToS3(imageStream, s3Key, 'image/png'),
+      // The stream is only written once an attempt succeeds, so a retry can reuse it
+      generate(base64, originalImageUrl).catch(async (error) => {
+        if (!originalImageUrl || !isImageUrlRejection(error)) {
+          throw error;
+        }
+        console.log(`   ↻ OpenAI could not fetch ${imageInfo.url}; retrying with the image inlined`);
+        return generate(await downloadImageBase64(imageInfo.url), null);
+      }).catch((error) => {
+        // Abort the pending upload so no partial object is written
+        imageStream.destroy(error);
+        throw error;
+      })
+    ]);
+    return s3Url;
+  };
+  
+  // Elements with identical requests (same cache key) share a single generation, so
+  // they neither pay twice nor race to write the same object
+  const generationsByKey = new Map();
+  
+  const processOne = async (imageInfo) => {
+    console.log(`📸 Processing ${imageInfo.elementId}...`);
+    
+    const elementContext = getElementContext(imageInfo);
+    const input = await prepareImageInput(imageInfo, brandInfo, elementContext, promptTemplates, dateStr);
+    if (input.cachedUrl) {
+      console.log(`   ✓ Reusing cached image ${input.cachedUrl}\n`);
+      return {
         originalUrl: imageInfo.url,
-        s3Url: s3Url,
+        s3Url: input.cachedUrl,
         width: imageInfo.width,
         height: imageInfo.height
       };
-      
-      imageUrlKeys.push(imageInfo.elementId);
-      
-      console.log(`   ✓ Completed ${imageInfo.elementId}\n`);
-    } catch (error) {
-      console.error(`   ✗ Failed to process ${imageInfo.elementId}: ${error.message}\n`);
+    }
+    
+    let generation = generationsByKey.get(input.s3Key);
+    if (generation) {
+      console.log(`   ↺ ${imageInfo.elementId} shares an identical generation in this run`);
+    } else {
+      generation = generateAndUpload(imageInfo, elementContext, input);
+      generationsByKey.set(input.s3Key, generation);
+    }
+    const s3Url = await generation;
+    
+    console.log(`   ✓ Completed ${imageInfo.elementId}\n`);
+    return {
+      originalUrl: imageInfo.url,
+      s3Url: s3Url,
+      width: imageInfo.width,
+      height: imageInfo.height
+    };
+  };
+  
+  // Downloads, generations and uploads are I/O bound, so overlap them.
+  // Batch mode trades latency for the Batch API's lower cost and separate rate limits.
+  const results = IMAGE_BATCH_MODE
+    ? await processImagesWithBatchAPI(imageUrls, getElementContext, brandInfo, promptTemplates, apiKey, dateStr)
+    : await mapPool(imageUrls, IMAGE_PROCESSING_CONCURRENCY, processOne);
+  
+  const imageMap = {};
+  const imageUrlKeys = [];
+  
+  // Results are indexed by position, so the map keeps template order
+  results.forEach((result, index) => {
+    const { elementId } = imageUrls[index];
+    if (result.status === 'fulfilled') {
+      imageMap[elementId] = result.value;
+      imageUrlKeys.push(elementId);
+    } else {
       // Continue with other images even if one fails
+      console.error(`   ✗ Failed to process ${elementId}: ${result.reason.message}\n`);
     }
-  }
+  });
   
   console.log(`✅ Image processing complete. Processed ${Object.keys(imageMap).length} image(s).\n`);
   return { imageUrlKeys, imageMap };
 }
 
-// Main code entrypoint
-export const runWorkflow = async (workflow, apiKey) => {
+// Run the agent's single turn through the Batch API: half the token cost and no
+// rate-limit pressure, at the price of up to 24h latency
+async function runAgentInBatch(agent, input, apiKey) {
+  const client = getOpenAIClient(apiKey);
+  const { reasoning, store } = agent.modelSettings;
+  const line = JSON.stringify({
+    custom_id: "agent-run",
+    method: "POST",
+    url: "/v1/responses",
+    body: {
+      model: agent.model,
+      instructions: agent.instructions,
+      input,
+      reasoning,
+      store
+    }
+  });
+  
+  const outputs = await runBatch(client, [line], "agent-request.jsonl");
+  const record = outputs.get("agent-run");
+  const body = record?.response?.body;
+  if (record?.error || !body) {
+    throw new Error(record?.error?.message || "Agent batch returned no response");
+  }
+  
+  // Concatenate the output_text parts of every message item
+  return (body.output || [])
+    .filter(item => item.type === 'message')
+    .flatMap(item => item.content || [])
+    .filter(part => part.type === 'output_text')
+    .map(part => part.text)
+    .join("");
+}
+
+// Main code entrypoint. `mode: "batch"` routes the agent call through the Batch API
+// for non-interactive runs; the default "sync" mode streams it.
+export const runWorkflow = async (workflow, apiKey, { mode = "sync" } = {}) => {
+  const { withTrace, user, Runner } = await loadAgentsSdk();
   return await withTrace("New workflow", async () => {
     console.log("📂 Reading brand guide and template funnel files...");
     
@@ -742,107 +1480,105 @@ export const runWorkflow = async (workflow, apiKey) => {
     const brandGuidePath = join(currentDir, "brandguide.txt");
     const templateFunnelPath = join(currentDir, "template_funnel.json");
     
+    // Read both files concurrently without blocking the event loop
     console.log(`   Reading: ${brandGuidePath}`);
-    const brandGuide = readFileSync(brandGuidePath, "utf-8");
-    console.log(`   ✓ Brand guide loaded (${brandGuide.length} chars)`);
-    
     console.log(`   Reading: ${templateFunnelPath}`);
-    const templateFunnel = readFileSync(templateFunnelPath, "utf-8");
+    const [brandGuide, templateFunnel] = await Promise.all([
+      readFile(brandGuidePath, "utf-8"),
+      readFile(templateFunnelPath, "utf-8")
+    ]);
+    console.log(`   ✓ Brand guide loaded (${brandGuide.length} chars)`);
     console.log(`   ✓ Template funnel loaded (${templateFunnel.length} chars)\n`);
     
     // Process images before agent execution
-    const { imageUrlKeys, imageMap } = await processImages(templateFunnel, brandGuide, apiKey);
+    // The brand guide is constant for the run, so parse it once rather than per image
+    const brandInfo = extractBrandInfo(brandGuide);
+    const { imageUrlKeys, imageMap } = await processImages(templateFunnel, brandInfo, apiKey);
     
     // Prepare image URL keys and mapping for agent
     const imageUrlKeysText = imageUrlKeys.length > 0 
       ? `\n\n=== IMAGE URL KEYS ===\n${JSON.stringify(imageUrlKeys, null, 2)}\n\n=== PROCESSED IMAGE MAP ===\n${JSON.stringify(imageMap, null, 2)}`
       : "";
     
-    // Combine workflow input with brand guide, template funnel, and processed images
-    const combinedInput = `${workflow.input_as_text}
-
-=== BRAND STYLE GUIDE & AVATAR ===
-${brandGuide}
+    // Only per-run content goes in the user turn; the static guidance and brand guide
+    // are the agent's system prompt so repeat runs hit the prompt cache
+    const agent = await getBrandAgent(brandGuide);
+    const combinedInput = [
+      workflow.input_as_text,
+      "",
+      "=== TEMPLATE FUNNEL JSON ===",
+      templateFunnel + imageUrlKeysText
+    ].join("\n");
 
-=== TEMPLATE FUNNEL JSON ===
-${templateFunnel}${imageUrlKeysText}
-
-IMPORTANT: The images identified in image_url_keys have already been processed and redesigned according to brand guidelines. They have been uploaded to S3 and the URLs are provided in the PROCESSED IMAGE MAP above. Use these S3 URLs in your output instead of the original URLs.`;
-
-    console.log(`📝 Preparing input (${combinedInput.length} total chars)...`);
+    console.log("📝 Preparing input...");
+    if (DEBUG) {
+      console.log(`   ${combinedInput.length} total chars`);
+    }
     const conversationHistory = [
       user(combinedInput)
     ];
     
-    console.log("📋 Setting up runner...");
-    const runner = new Runner({
-      traceMetadata: {
-        __trace_source__: "agent-builder",
-        workflow_id: "wf_69043945c8e48190bbe9d846914c78a80d481960236c2925"
+    if (mode === "batch") {
+      console.log("📦 Submitting agent run to the Batch API...\n");
+      const output = await runAgentInBatch(agent, combinedInput, apiKey);
+      if (!output) {
+        throw new Error("Agent result is undefined");
       }
-    });
+      console.log("✅ Agent batch completed\n");
+      return { output_text: output };
+    }
+    
+    console.log("📋 Setting up runner...");
+    const runner = getRunner(Runner);
     
     console.log("🚀 Starting agent execution...\n");
     console.log("=".repeat(80));
     
-    let finalOutput = "";
-    console.log("⏳ Processing... (this may take a moment)\n");
+    console.log("⏳ Streaming agent output...\n");
     
-    const startTime = Date.now();
+    // Monotonic clock for the run duration; the streamed text itself is the progress signal
+    const startTime = performance.now();
     
-    // Show progress dots while processing
-    const progressInterval = setInterval(() => {
-      process.stdout.write(".");
-    }, 2000); // Print a dot every 2 seconds
-    
-    try {
+    // Stream the run so output is written as it is generated instead of after completion
     const myAgentResultTemp = await runner.run(
-      myAgent,
+      agent,
       [
         ...conversationHistory
-      ]
+      ],
+      { stream: true }
     );
-      
-      clearInterval(progressInterval);
-      const duration = ((Date.now() - startTime) / 1000).toFixed(2);
-      console.log(`\n\n✅ Completed in ${duration}s`);
-      
-      // Check if reasoning is available in the result
-      if (myAgentResultTemp.reasoning) {
-        console.log("\n" + "=".repeat(80));
-        console.log("🤔 REASONING:");
-        console.log("=".repeat(80));
-        if (typeof myAgentResultTemp.reasoning === 'string') {
-          console.log(myAgentResultTemp.reasoning);
-        } else if (myAgentResultTemp.reasoning.content) {
-          console.log(myAgentResultTemp.reasoning.content);
-        } else {
-          console.log(JSON.stringify(myAgentResultTemp.reasoning, null, 2));
-        }
-      }
-      
-      // Check newItems for reasoning
-      if (myAgentResultTemp.newItems) {
-        for (const item of myAgentResultTemp.newItems) {
-          if (item.type === 'reasoning' || item.reasoning) {
-            console.log("\n🤔 Reasoning found in items:");
-            console.log(item.reasoning || item.content || item.text || JSON.stringify(item, null, 2));
-          }
-        }
-      }
-
-    if (!myAgentResultTemp.finalOutput) {
-        throw new Error("Agent result is undefined");
+    
+    let streamedText = "";
+    for await (const delta of myAgentResultTemp.toTextStream()) {
+      streamedText += delta;
+      process.stdout.write(delta);
     }
-      
-      finalOutput = myAgentResultTemp.finalOutput;
-    } catch (error) {
-      clearInterval(progressInterval);
-      throw error;
+    await myAgentResultTemp.completed;
+    
+    const duration = ((performance.now() - startTime) / 1000).toFixed(2);
+    console.log(`\n\n✅ Completed in ${duration}s`);
+    
+    // Reasoning dumps can be large, so they are only printed in debug runs
+    if (DEBUG && myAgentResultTemp.reasoning) {
+      console.log("\n" + "=".repeat(80));
+      console.log("🤔 REASONING:");
+      console.log("=".repeat(80));
+      console.log(summarizeRunItem(myAgentResultTemp.reasoning));
     }
-
+    
+    // The agent has no tools, so a run is a single turn with at most one reasoning item
+    if (DEBUG && myAgentResultTemp.newItems) {
+      const reasoningItem = myAgentResultTemp.newItems.find(item => item.type === 'reasoning' || item.reasoning);
+      if (reasoningItem) {
+        console.log("\n🤔 Reasoning found in items:");
+        console.log(summarizeRunItem(reasoningItem));
+      }
+    }
+    
+    // Streamed text is the primary output; finalOutput covers runs that emitted no text deltas
+    const finalOutput = streamedText || myAgentResultTemp.finalOutput;
     if (!finalOutput) {
-        throw new Error("Agent result is undefined");
+      throw new Error("Agent result is undefined");
     }
 
     console.log("\n" + "=".repeat(80));
@@ -856,36 +1592,199 @@ IMPORTANT: The images identified in image_url_keys have already been processed a
   });
 }
 
-// Function to get Tracing Exporter API key from AWS Secrets Manager
-function getTracingExporterKeyFromAWS() {
+// Resolved secrets are reused across workflow runs in the same process. Only
+// non-empty values are cached so a transient miss is retried on the next call.
+const SECRET_CACHE_TTL_MS = 15 * 60 * 1000;
+const secretCache = new Map();
+// Winning value per candidate list, under the same TTL. Without it, every higher-priority
+// candidate that doesn't exist would be looked up again on each call.
+const resolvedSecretCache = new Map();
+
+// The Secrets Manager SDK is likewise loaded on first lookup; the client is created once
+let secretsManagerPromise = null;
+
+function getSecretsManager() {
+  secretsManagerPromise ??= import("@aws-sdk/client-secrets-manager").then(sdk => ({
+    sdk,
+    // Retries are handled by sendSecretsCommand; the SDK's own (maxAttempts: 3 by default)
+    // would multiply with them
+    client: new sdk.SecretsManagerClient({
+      region: 'us-west-2',
+      maxAttempts: 1,
+      requestHandler: { httpsAgent: awsHttpsAgent }
+    })
+  }));
+  return secretsManagerPromise;
+}
+
+function getCachedSecret(secretName) {
+  const entry = secretCache.get(secretName);
+  if (!entry) {
+    return null;
+  }
+  if (Date.now() - entry.fetchedAt > SECRET_CACHE_TTL_MS) {
+    secretCache.delete(secretName);
+    return null;
+  }
+  return entry.value;
+}
+
+function cacheSecret(secretName, value) {
+  if (value) {
+    secretCache.set(secretName, { value, fetchedAt: Date.now() });
+  }
+}
+
+// Map of name -> value for the candidates currently in the cache
+function collectCachedSecrets(secretNames) {
+  const secrets = new Map();
+  for (const name of secretNames) {
+    const value = getCachedSecret(name);
+    if (value) {
+      secrets.set(name, value);
+    }
+  }
+  return secrets;
+}
+
+// BatchGetSecretValue accepts at most 20 secret ids per call
+const SECRET_BATCH_SIZE = 20;
+// Cap on concurrent GetSecretValue probes so the fallback doesn't trip API throttling
+const SECRET_PROBE_CONCURRENCY = 3;
+
+// Secret names tried in priority order. The tracing lookup prefers a dedicated tracing
+// key and otherwise settles for one of the OpenAI key's names.
+const OPENAI_SECRET_CANDIDATES = Object.freeze([
+  "OPENAI_API_KEY_SECRET_NAME",
+  "OpenAIAPIKey-dbc33f7701e74c42b278c0bf0dbc47d2",
+  "OpenAIApiKey"
+]);
+const TRACING_SECRET_CANDIDATES = Object.freeze([
+  "OPENAI_TRACING_API_KEY",
+  "OpenAITracingAPIKey",
+  ...OPENAI_SECRET_CANDIDATES
+]);
+
+// Throttling, timeouts and server-side failures are transient. Missing secrets and denied
+// access are definitive, so the caller moves on to the next candidate instead.
+const NON_RETRYABLE_SECRET_ERRORS = new Set(['ResourceNotFoundException', 'AccessDeniedException']);
+const RETRYABLE_SECRET_ERRORS = new Set(['ThrottlingException', 'TooManyRequestsException', 'TimeoutError', 'InternalServiceError']);
+
+function isRetryableSecretsError(error) {
+  if (NON_RETRYABLE_SECRET_ERRORS.has(error.name)) {
+    return false;
+  }
+  if (RETRYABLE_SECRET_ERRORS.has(error.name)) {
+    return true;
+  }
+  const status = error.$metadata?.httpStatusCode;
+  if (typeof status === 'number') {
+    return status === 429 || status >= 500;
+  }
+  return ['ECONNRESET', 'ETIMEDOUT', 'EPIPE', 'ECONNREFUSED'].includes(error.code);
+}
+
+// Secrets Manager calls are short, so back off briefly before giving up on a transient error
+function sendSecretsCommand(client, command, label) {
+  return withRetries(() => client.send(command), {
+    retries: 3,
+    baseMs: 50,
+    jitterMs: 50,
+    shouldRetry: isRetryableSecretsError,
+    onRetry: (error, attempt, delay) => console.log(`   ↻ Retrying secret lookup ${label} (attempt ${attempt}) in ${Math.round(delay)}ms: ${error.name}`)
+  });
+}
+
+// Lookups requested in the same turn (e.g. the OpenAI and tracing keys under Promise.all)
+// share one round trip: their names queue up until the client is ready, then the union
+// is fetched together.
+let queuedSecretNames = null;
+let queuedSecretFetch = null;
+
+// Resolve candidate secrets with one BatchGetSecretValue round trip for everything not
+// already cached. Returns a Map of name -> SecretString for the candidates that exist.
+async function fetchSecrets(secretNames) {
+  const missing = secretNames.filter(name => !getCachedSecret(name));
+  if (missing.length === 0) {
+    return collectCachedSecrets(secretNames);
+  }
+  
+  if (queuedSecretFetch === null) {
+    const names = new Set();
+    queuedSecretNames = names;
+    queuedSecretFetch = getSecretsManager()
+      .finally(() => {
+        // The batch is closed once the client is ready; later lookups start a new one
+        queuedSecretNames = null;
+        queuedSecretFetch = null;
+      })
+      .then(({ sdk, client }) => loadSecrets(sdk, client, [...names]));
+  }
+  for (const name of missing) {
+    queuedSecretNames.add(name);
+  }
+  
+  await queuedSecretFetch;
+  return collectCachedSecrets(secretNames);
+}
+
+// Fetch the named secrets into the cache
+async function loadSecrets(sdk, secretsManagerClient, missing) {
   try {
-    // Try common secret names, or reuse OpenAI API key
-    const secretNames = [
-      "OPENAI_TRACING_API_KEY",
-      "OpenAITracingAPIKey",
-      "OPENAI_API_KEY_SECRET_NAME",
-      "OpenAIAPIKey-dbc33f7701e74c42b278c0bf0dbc47d2",
-      "OpenAIApiKey"
-    ];
-    
-    for (const secretName of secretNames) {
-      try {
-        const result = execSync(
-          `aws secretsmanager get-secret-value --secret-id ${secretName} --region us-west-2 --query SecretString --output text`,
-          { encoding: 'utf-8', stdio: ['pipe', 'pipe', 'pipe'] }
-        ).trim();
-        
-        if (result && !result.includes('Error')) {
-          return result;
-        }
-      } catch (e) {
-        // Try next secret name
-        continue;
+    for (let i = 0; i < missing.length; i += SECRET_BATCH_SIZE) {
+      const { SecretValues = [] } = await sendSecretsCommand(secretsManagerClient, new sdk.BatchGetSecretValueCommand({
+        SecretIdList: missing.slice(i, i + SECRET_BATCH_SIZE)
+      }), 'BatchGetSecretValue');
+      for (const secret of SecretValues) {
+        cacheSecret(secret.Name, secret.SecretString);
       }
     }
-    
-    // If no specific tracing key found, return null to use OpenAI API key as fallback
-    return null;
+  } catch (error) {
+    // BatchGetSecretValue needs its own IAM permission; fall back to per-secret reads,
+    // probing candidates in parallel. Misses (e.g. ResourceNotFoundException) settle as
+    // rejections and the caller still picks the first hit in candidate order.
+    console.log(`   Batch secret lookup unavailable (${error.name}), reading secrets individually`);
+    const pending = missing.filter(name => !getCachedSecret(name));
+    const probes = await mapPool(pending, SECRET_PROBE_CONCURRENCY, async (name) => {
+      const response = await sendSecretsCommand(secretsManagerClient, new sdk.GetSecretValueCommand({ SecretId: name }), name);
+      cacheSecret(name, response.SecretString);
+    });
+    // A missing secret is expected while walking the candidates; anything else means the
+    // lookup itself failed, which shouldn't be mistaken for the secret not existing
+    probes.forEach((probe, i) => {
+      if (probe.status === 'rejected' && probe.reason?.name !== 'ResourceNotFoundException') {
+        console.log(`   ⚠️  Could not read secret ${pending[i]} (${probe.reason?.name}): ${probe.reason?.message}`);
+      }
+    });
+  }
+}
+
+// Resolve the first candidate secret that exists, in candidate order, through the
+// shared cache and SDK client. Returns null when none of the candidates exist.
+async function resolveFirstSecret(candidateNames) {
+  const listKey = candidateNames.join('\n');
+  const resolved = resolvedSecretCache.get(listKey);
+  if (resolved && Date.now() - resolved.fetchedAt <= SECRET_CACHE_TTL_MS) {
+    return resolved.value;
+  }
+  
+  const secrets = await fetchSecrets(candidateNames);
+  for (const secretName of candidateNames) {
+    if (secrets.has(secretName)) {
+      const value = secrets.get(secretName);
+      resolvedSecretCache.set(listKey, { value, fetchedAt: Date.now() });
+      return value;
+    }
+  }
+  return null;
+}
+
+// Function to get Tracing Exporter API key from AWS Secrets Manager
+async function getTracingExporterKeyFromAWS() {
+  try {
+    // Try common secret names, or reuse OpenAI API key. If no specific tracing key is
+    // found, null tells the caller to use the OpenAI API key as fallback.
+    return await resolveFirstSecret(TRACING_SECRET_CANDIDATES);
   } catch (error) {
     console.error("Error fetching tracing exporter API key:", error);
     return null;
@@ -893,32 +1792,14 @@ function getTracingExporterKeyFromAWS() {
 }
 
 // Function to get OpenAI API key from AWS Secrets Manager
-function getOpenAIKeyFromAWS() {
+async function getOpenAIKeyFromAWS() {
   try {
     // Try common secret names
-    const secretNames = [
-      "OPENAI_API_KEY_SECRET_NAME",
-      "OpenAIAPIKey-dbc33f7701e74c42b278c0bf0dbc47d2",
-      "OpenAIApiKey"
-    ];
-    
-    for (const secretName of secretNames) {
-      try {
-        const result = execSync(
-          `aws secretsmanager get-secret-value --secret-id ${secretName} --region us-west-2 --query SecretString --output text`,
-          { encoding: 'utf-8', stdio: ['pipe', 'pipe', 'pipe'] }
-        ).trim();
-        
-        if (result && !result.includes('Error')) {
-          return result;
-        }
-      } catch (e) {
-        // Try next secret name
-        continue;
-      }
+    const apiKey = await resolveFirstSecret(OPENAI_SECRET_CANDIDATES);
+    if (!apiKey) {
+      throw new Error("Could not retrieve OpenAI API key from AWS Secrets Manager");
     }
-    
-    throw new Error("Could not retrieve OpenAI API key from AWS Secrets Manager");
+    return apiKey;
   } catch (error) {
     console.error("Error fetching API key:", error);
     throw error;
@@ -929,21 +1810,37 @@ function getOpenAIKeyFromAWS() {
 if (import.meta.url === `file://${process.argv[1]}` || require.main === module) {
   (async () => {
     try {
-      console.log("Fetching OpenAI API key from AWS Secrets Manager...\n");
-      const apiKey = getOpenAIKeyFromAWS();
+      // Trace export is opt-in (OPENAI_AGENTS_TRACING=1). With it off, startup
+      // resolves only the OpenAI key, halving the secret lookups, and the SDK's
+      // exporter is disabled rather than falling back to the OpenAI key.
+      const tracingEnabled = process.env.OPENAI_AGENTS_TRACING === "1";
+
+      console.log(tracingEnabled
+        ? "Fetching OpenAI and tracing API keys from AWS Secrets Manager...\n"
+        : "Fetching OpenAI API key from AWS Secrets Manager...\n");
+      // The Agents SDK import is independent of the secret lookups, so load it alongside them
+      const [apiKey, tracingKey, { setDefaultOpenAIKey, setTracingExportApiKey, setTracingDisabled }] = await Promise.all([
+        getOpenAIKeyFromAWS(),
+        tracingEnabled ? getTracingExporterKeyFromAWS() : null,
+        loadAgentsSdk()
+      ]);
       setDefaultOpenAIKey(apiKey);
       console.log("API key retrieved successfully.\n");
       
-      // Configure tracing exporter
-      console.log("Configuring tracing exporter...\n");
-      const tracingKey = getTracingExporterKeyFromAWS();
-      if (tracingKey) {
-        setTracingExportApiKey(tracingKey);
-        console.log("Tracing exporter API key configured.\n");
+      if (tracingEnabled) {
+        // Configure tracing exporter
+        console.log("Configuring tracing exporter...\n");
+        if (tracingKey) {
+          setTracingExportApiKey(tracingKey);
+          console.log("Tracing exporter API key configured.\n");
+        } else {
+          // Use OpenAI API key as fallback for tracing exporter
+          setTracingExportApiKey(apiKey);
+          console.log("Using OpenAI API key for tracing exporter.\n");
+        }
       } else {
-        // Use OpenAI API key as fallback for tracing exporter
-        setTracingExportApiKey(apiKey);
-        console.log("Using OpenAI API key for tracing exporter.\n");
+        setTracingDisabled(true);
+        console.log("Tracing export disabled (set OPENAI_AGENTS_TRACING=1 to enable).\n");
       }
       
       console.log("=".repeat(80));
@@ -952,7 +1849,7 @@ if (import.meta.url === `file://${process.argv[1]}` || require.main === module)
       
       const result = await runWorkflow({ 
         input_as_text: "Please rewrite the funnel JSON according to the brand style guide and avatar provided." 
-      }, apiKey);
+      }, apiKey, { mode: process.env.WORKFLOW_MODE || "sync" });
       
       console.log("\n" + "=".repeat(80));
       console.log("📤 FINAL OUTPUT");